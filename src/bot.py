@@ -1,135 +1,349 @@
 import os
+import sys
 import time
+import asyncio
 import logging
 from typing import Optional
 
 import discord
-from discord.ext import commands, tasks
+from aiohttp import web
+from discord.ext import commands
 from dotenv import load_dotenv
 
-from prometheus_client import Counter, Gauge, Info, start_http_server
+from prometheus_client import Gauge
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.core import REGISTRY, CounterMetricFamily
+from prometheus_client.registry import Collector
 
 # ================== Config & setup ==================
 load_dotenv()
 token = os.getenv("DISCORD_TOKEN")
 PROM_PORT = int(os.getenv("PROM_PORT", "9108"))
-TICK_SECONDS = float(os.getenv("TICK_SECONDS", "5"))
 
 # Optional: library logs to a file
 handler = logging.FileHandler(filename="../discord.log", encoding="utf-8", mode="w")
+# Child of the "discord" logger, so it ends up in the same file
+log = logging.getLogger("discord.metrical")
 
-intents = discord.Intents.default()
+# Voice accounting only needs guild/channel state and voice states; everything else
+# (messages, typing, reactions, presences, message content) is gateway traffic we'd discard
+intents = discord.Intents.none()
 intents.guilds = True
 intents.voice_states = True
-# Optional: nicer display names & reliable seeding of members on startup
-# (Requires "Server Members Intent" enabled in the Dev Portal)
-intents.members = True
-
-bot = commands.Bot(command_prefix="!", intents=intents)
+# No members intent: voice state events carry the Member (with display_name) already,
+# and only members currently in voice need to be cached
+bot = commands.Bot(
+    command_prefix="!",
+    intents=intents,
+    member_cache_flags=discord.MemberCacheFlags(voice=True, joined=False),
+)
 
 # ================== Prometheus metrics ==================
-# Counters (seconds, monotonic)
-VOICE_USER_SECONDS = Counter(
-    "voice_user_seconds_total",
-    "Cumulative seconds a user spent in any voice channel",
-    ["guild_id", "user_id"],
-)
-VOICE_CHANNEL_ACTIVE_SECONDS = Counter(
-    "voice_channel_active_seconds_total",
-    "Cumulative seconds a voice channel had >=1 user (union time)",
-    ["guild_id", "channel_id", "channel_name"],
-)
-VOICE_GUILD_ACTIVE_SECONDS = Counter(
-    "voice_guild_active_seconds_total",
-    "Cumulative seconds a guild had >=1 user in any voice channel (union time)",
-    ["guild_id", "guild_name"],
-)
+# Counters (seconds, monotonic) are computed at scrape time, see VoiceSecondsCollector
 
 # Gauges (instantaneous)
 VOICE_CHANNEL_ACTIVE = Gauge(
     "voice_channel_active",
     "1 if a voice channel has >=1 user, else 0",
-    ["guild_id", "channel_id", "channel_name"],
+    ["guild_id", "channel_id"],
 )
 VOICE_CHANNEL_ACTIVE_USERS = Gauge(
     "voice_channel_active_users",
     "Current number of users in the voice channel",
-    ["guild_id", "channel_id", "channel_name"],
+    ["guild_id", "channel_id"],
 )
 
-# "Info" metrics (IDs -> latest names for pretty dashboards)
-DISCORD_USER = Info(
-    "discord_user",
-    "Latest known username/global_name for a user_id",
-    ["user_id"],
-)
-DISCORD_USER_DISPLAY = Info(
-    "discord_user_display",
-    "Latest known display_name (nickname) for a user_id in a guild",
-    ["guild_id", "user_id"],
+# Channel names live in their own series so renames don't fork the channel metrics.
+# Join in PromQL: ... * on(guild_id, channel_id) group_left(channel_name) voice_channel_info
+VOICE_CHANNEL_INFO = Gauge(
+    "voice_channel_info",
+    "Always 1; maps a voice channel_id to its latest known channel_name",
+    ["guild_id", "channel_id", "channel_name"],
 )
 
+# No per-user series: user_id is unbounded cardinality for Prometheus.
+# Names are served as JSON on /users and logged to discord.log instead (see _set_user_info).
+
 # ================== In-memory presence state ==================
-# (guild_id, user_id) -> {"channel_id": int}
-active_users: dict[tuple[int, int], dict[str, int]] = {}
+# (guild_id, user_id) -> channel_id
+user_channel: dict[tuple[int, int], int] = {}
 
-# (guild_id, channel_id) -> set(user_id)
-channel_presence: dict[tuple[int, int], set[int]] = {}
+# (guild_id, channel_id) -> number of users in it (entries dropped at 0)
+channel_count: dict[tuple[int, int], int] = {}
 
-# Monotonic clock for accurate elapsed time
-_last_tick = time.monotonic()
+# guild_id -> number of non-empty voice channels (entries dropped at 0)
+guild_active_channels: dict[int, int] = {}
 
-# ================== Helpers ==================
-def _labels_channel(guild: discord.Guild, channel_id: int):
-    ch = guild.get_channel(channel_id)
-    name = ch.name if isinstance(ch, discord.VoiceChannel) else f"id:{channel_id}"
-    return {"guild_id": str(guild.id), "channel_id": str(channel_id), "channel_name": name}
+# channel_id -> latest known name (refreshed by voice events & on_guild_channel_update)
+channel_name_cache: dict[int, str] = {}
+
+# (guild_id, channel_id) -> memoized channel label dict (ids only), dropped on channel delete
+_channel_labels_cache: dict[tuple[int, int], dict[str, str]] = {}
+
+# channel_id -> channel_name currently exported on voice_channel_info
+_channel_info_names: dict[int, str] = {}
+
+# guild_id -> guild name snapshot for voice_guild_active_seconds_total
+guild_name_cache: dict[int, str] = {}
+
+# guild_id -> memoized [guild_id, guild_name] label values, dropped on rename
+_guild_labels: dict[int, list[str]] = {}
 
-def _labels_guild(guild: discord.Guild):
-    return {"guild_id": str(guild.id), "guild_name": guild.name or f"id:{guild.id}"}
+# (guild_id, channel_id) -> (active, active_users) labelled children,
+# only while the channel has users
+_channel_children: dict[tuple[int, int], tuple[Gauge, Gauge]] = {}
 
-def _add_presence(gid: int, cid: Optional[int], uid: int) -> None:
+# Seconds clocks: key -> (total, rate, since). Accrues `rate` seconds per second since
+# `since` (monotonic) on top of `total`; replaced as a whole tuple on every change.
+# guild_id -> users in voice (voice_user_seconds_total)
+_user_clocks: dict[int, tuple[float, int, float]] = {}
+# (guild_id, channel_id) -> channel has users (voice_channel_active_seconds_total)
+_channel_clocks: dict[tuple[int, int], tuple[float, int, float]] = {}
+# guild_id -> guild has an active channel (voice_guild_active_seconds_total)
+_guild_clocks: dict[int, tuple[float, int, float]] = {}
+
+# id -> interned str(id), reused for every label value instead of re-stringifying
+_gid_str: dict[int, str] = {}
+_cid_str: dict[int, str] = {}
+
+# Console lines from voice handlers, written out by _log_writer (dropped when full)
+_log_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=1000)
+_log_writer_task: Optional[asyncio.Task] = None
+
+# Latest names seen in voice, served on /users. display_name is a per-guild nickname.
+# user_id -> (name, global_name)
+user_names: dict[int, tuple[str, str]] = {}
+# (guild_id, user_id) -> display_name
+display_names: dict[tuple[int, int], str] = {}
+
+# ================== Helpers ==================
+def _id_str(cache: dict[int, str], i: int) -> str:
+    s = cache.get(i)
+    if s is None:
+        s = cache[i] = sys.intern(str(i))
+    return s
+
+def _labels_channel(gid: int, channel_id: int):
+    key = (gid, channel_id)
+    labels = _channel_labels_cache.get(key)
+    if labels is None:
+        labels = _channel_labels_cache[key] = {
+            "guild_id": _id_str(_gid_str, gid),
+            "channel_id": _id_str(_cid_str, channel_id),
+        }
+    return labels
+
+def _channel_name(guild: discord.Guild, channel_id: int) -> str:
+    name = channel_name_cache.get(channel_id)
+    if name is None:
+        ch = guild.get_channel(channel_id)
+        if isinstance(ch, discord.VoiceChannel):
+            name = channel_name_cache[channel_id] = ch.name
+        else:
+            name = f"id:{channel_id}"
+    return name
+
+def _set_channel_info(guild: discord.Guild, channel_id: int) -> None:
+    # Export the current name, removing the series for the previous one (no zombie labels)
+    name = _channel_name(guild, channel_id)
+    old = _channel_info_names.get(channel_id)
+    if old == name:
+        return
+    labels = _labels_channel(guild.id, channel_id)
+    if old is not None:
+        VOICE_CHANNEL_INFO.remove(labels["guild_id"], labels["channel_id"], old)
+    VOICE_CHANNEL_INFO.labels(channel_name=name, **labels).set(1)
+    _channel_info_names[channel_id] = name
+
+def _labels_guild(gid: int):
+    labels = _guild_labels.get(gid)
+    if labels is None:
+        labels = _guild_labels[gid] = [_id_str(_gid_str, gid), guild_name_cache.get(gid) or f"id:{gid}"]
+    return labels
+
+def _set_guild_name(gid: int, name: str) -> None:
+    if guild_name_cache.get(gid) != name:
+        guild_name_cache[gid] = name
+        _guild_labels.pop(gid, None)
+
+def _make_channel_children(gid: int, channel_id: int):
+    labels = _labels_channel(gid, channel_id)
+    return (
+        VOICE_CHANNEL_ACTIVE.labels(**labels),
+        VOICE_CHANNEL_ACTIVE_USERS.labels(**labels),
+    )
+
+def _clock_add(clocks: dict, key, delta: int) -> None:
+    # Fold the time accrued so far into total, then change the rate
+    now = time.monotonic()
+    total, rate, since = clocks.get(key, (0.0, 0, now))
+    clocks[key] = (total + rate * (now - since), rate + delta, now)
+
+def _clock_read(clock: tuple[float, int, float], now: float) -> float:
+    total, rate, since = clock
+    return total + rate * (now - since)
+
+def _add_presence(guild: discord.Guild, cid: Optional[int]) -> None:
     if cid is None:
         return
-    key = (gid, cid)
-    s = channel_presence.get(key)
-    if s is None:
-        s = set()
-        channel_presence[key] = s
-    s.add(uid)
-
-def _remove_presence(gid: int, cid: Optional[int], uid: int) -> None:
+    key = (guild.id, cid)
+    n = channel_count.get(key, 0)
+    channel_count[key] = n + 1
+    _clock_add(_user_clocks, guild.id, +1)
+    if n == 0:
+        g = guild_active_channels.get(guild.id, 0)
+        guild_active_channels[guild.id] = g + 1
+        if g == 0:
+            _set_guild_name(guild.id, guild.name)
+            _clock_add(_guild_clocks, guild.id, +1)
+        _clock_add(_channel_clocks, key, +1)
+        _channel_children[key] = _make_channel_children(guild.id, cid)
+        _set_channel_info(guild, cid)
+
+def _remove_presence(gid: int, cid: Optional[int]) -> None:
     if cid is None:
         return
     key = (gid, cid)
-    s = channel_presence.get(key)
-    if s and uid in s:
-        s.remove(uid)
-        if not s:
-            channel_presence.pop(key, None)
-
-def _update_channel_gauges(guild: discord.Guild, channel_id: int) -> None:
-    labels = _labels_channel(guild, channel_id)
-    users = len(channel_presence.get((guild.id, channel_id), set()))
-    VOICE_CHANNEL_ACTIVE_USERS.labels(**labels).set(users)
-    VOICE_CHANNEL_ACTIVE.labels(**labels).set(1 if users > 0 else 0)
-
-def _set_user_info(user: discord.abc.User) -> None:
-    # Record the latest username & global_name for this user_id
-    username = getattr(user, "name", None) or ""
-    global_name = getattr(user, "global_name", None) or ""
-    DISCORD_USER.labels(user_id=str(user.id)).info({
-        "username": username,
-        "global_name": global_name,
-    })
-
-def _set_member_display(member: discord.Member) -> None:
-    # Record the latest display_name (guild nickname fallback to username/global_name)
-    display_name = member.display_name or getattr(member, "global_name", None) or member.name
-    DISCORD_USER_DISPLAY.labels(
-        guild_id=str(member.guild.id),
-        user_id=str(member.id),
-    ).info({"display_name": display_name})
+    n = channel_count.get(key, 0)
+    if n == 0:
+        return
+    _clock_add(_user_clocks, gid, -1)
+    if n > 1:
+        channel_count[key] = n - 1
+        return
+    del channel_count[key]
+    _clock_add(_channel_clocks, key, -1)
+    if guild_active_channels.get(gid, 0) > 1:
+        guild_active_channels[gid] -= 1
+    else:
+        guild_active_channels.pop(gid, None)
+        _clock_add(_guild_clocks, gid, -1)
+    # Channel went idle: zero the gauges, then drop the cached children
+    active, users = _channel_children.pop(key)
+    active.set(0)
+    users.set(0)
+
+def _track_user(guild: discord.Guild, uid: int, cid: Optional[int]) -> None:
+    """Point (guild, uid) at voice channel cid (None = not in voice).
+
+    user_channel is the single source of truth for who is where, so the per-channel
+    counts stay exact even if an event repeats a state we already know (e.g. after seeding).
+    """
+    key = (guild.id, uid)
+    prev_cid = user_channel.get(key)
+    if prev_cid == cid:
+        return
+    _remove_presence(guild.id, prev_cid)
+    if cid is None:
+        user_channel.pop(key, None)
+    else:
+        user_channel[key] = cid
+        _add_presence(guild, cid)
+
+def _update_channel_gauges(gid: int, channel_id: int) -> None:
+    key = (gid, channel_id)
+    n = channel_count.get(key, 0)
+    if n:
+        active, users = _channel_children[key]
+        users.set(n)
+        active.set(1)
+
+def _set_user_info(member: discord.Member) -> None:
+    # Record the latest names for this member; only log values that actually changed
+    names = (member.name or "", getattr(member, "global_name", None) or "")
+    if user_names.get(member.id) != names:
+        user_names[member.id] = names
+        log.info("user uid=%s username=%r global_name=%r", member.id, *names)
+    key = (member.guild.id, member.id)
+    display_name = member.display_name or ""
+    if display_names.get(key) != display_name:
+        display_names[key] = display_name
+        log.info("member gid=%s uid=%s display_name=%r", member.guild.id, member.id, display_name)
+
+def _console(msg: str) -> None:
+    # Never block a voice handler on terminal I/O
+    try:
+        _log_queue.put_nowait(msg)
+    except asyncio.QueueFull:
+        pass
+
+async def _log_writer() -> None:
+    """Drain _log_queue to stdout, one write + flush per ~100ms batch."""
+    while True:
+        lines = [await _log_queue.get()]
+        await asyncio.sleep(0.1)
+        while not _log_queue.empty():
+            lines.append(_log_queue.get_nowait())
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+# ================== Scrape-time counters ==================
+class VoiceSecondsCollector(Collector):
+    """Yields the *_seconds_total counters from the presence clocks on each scrape."""
+
+    def collect(self):
+        now = time.monotonic()
+        # Scrapes are served on the bot's event loop (see start_exporter), so no event
+        # handler can run mid-collect and the dicts can be iterated directly
+        user_seconds = CounterMetricFamily(
+            "voice_user_seconds",
+            "Cumulative seconds users spent in any voice channel (summed per guild)",
+            labels=["guild_id"],
+        )
+        for gid, clock in _user_clocks.items():
+            user_seconds.add_metric([_id_str(_gid_str, gid)], _clock_read(clock, now))
+        yield user_seconds
+
+        channel_seconds = CounterMetricFamily(
+            "voice_channel_active_seconds",
+            "Cumulative seconds a voice channel had >=1 user (union time)",
+            labels=["guild_id", "channel_id"],
+        )
+        for (gid, cid), clock in _channel_clocks.items():
+            channel_seconds.add_metric([_id_str(_gid_str, gid), _id_str(_cid_str, cid)], _clock_read(clock, now))
+        yield channel_seconds
+
+        guild_seconds = CounterMetricFamily(
+            "voice_guild_active_seconds",
+            "Cumulative seconds a guild had >=1 user in any voice channel (union time)",
+            labels=["guild_id", "guild_name"],
+        )
+        for gid, clock in _guild_clocks.items():
+            guild_seconds.add_metric(_labels_guild(gid), _clock_read(clock, now))
+        yield guild_seconds
+
+REGISTRY.register(VoiceSecondsCollector())
+_exporter_started = False
+
+async def _serve_metrics(request: web.Request) -> web.Response:
+    # Same behaviour as prometheus_client's own server: OpenMetrics negotiation,
+    # name[] filtering and gzip when the scraper accepts it
+    encoder, content_type = choose_encoder(request.headers.get("Accept", ""))
+    names = request.query.getall("name[]", [])
+    registry = REGISTRY.restricted_registry(names) if names else REGISTRY
+    response = web.Response(body=encoder(registry), headers={"Content-Type": content_type})
+    response.enable_compression()
+    return response
+
+async def _serve_users(request: web.Request) -> web.Response:
+    # Name lookup for dashboards (e.g. Grafana JSON datasource), kept out of Prometheus
+    # {user_id: {"name", "global_name", "display_names": {guild_id: display_name}}}
+    users = {
+        uid: {"name": name, "global_name": global_name, "display_names": {}}
+        for uid, (name, global_name) in user_names.items()
+    }
+    for (gid, uid), display_name in display_names.items():
+        users[uid]["display_names"][str(gid)] = display_name
+    return web.json_response({str(uid): info for uid, info in users.items()})
+
+async def start_exporter() -> None:
+    """Serve /metrics (and /users) from the bot's own event loop instead of a separate exporter thread."""
+    app = web.Application()
+    app.router.add_get("/metrics", _serve_metrics)
+    app.router.add_get("/users", _serve_users)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=PROM_PORT).start()
 
 # ================== Events ==================
 @bot.event
@@ -138,11 +352,14 @@ async def on_ready():
     for g in bot.guilds:
         print(f" - connected to: {g.name} (gid={g.id})")
 
-    # Start Prometheus exporter & accrual loop
-    start_http_server(PROM_PORT)
-    print(f"[metrics] Prometheus exporter on :{PROM_PORT}/metrics")
-    if not accrue_loop.is_running():
-        accrue_loop.start()
+    # Start console writer & Prometheus exporter (on_ready may fire again after a reconnect)
+    global _exporter_started, _log_writer_task
+    if _log_writer_task is None:
+        _log_writer_task = asyncio.create_task(_log_writer())
+    if not _exporter_started:
+        await start_exporter()
+        _exporter_started = True
+        print(f"[metrics] Prometheus exporter on :{PROM_PORT}/metrics")
 
     # Seed current voice state so people already in voice are counted immediately
     await seed_current_voice_state()
@@ -153,13 +370,10 @@ async def seed_current_voice_state():
     for guild in bot.guilds:
         for ch in getattr(guild, "voice_channels", []):
             for m in ch.members:
-                gid, uid = guild.id, m.id
-                active_users[(gid, uid)] = {"channel_id": ch.id}
-                _add_presence(gid, ch.id, uid)
-                _update_channel_gauges(guild, ch.id)
-                # also set latest names
+                _track_user(guild, m.id, ch.id)
+                _update_channel_gauges(guild.id, ch.id)
+                # also record latest names
                 _set_user_info(m)
-                _set_member_display(m)
                 seeded_users += 1
     if seeded_users:
         print(f"[seed] Initialized presence for {seeded_users} member(s) already in voice.")
@@ -167,92 +381,86 @@ async def seed_current_voice_state():
 # ---- JOIN / LEAVE console prints + presence updates ----
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    # Mute/deafen/stream/video toggles keep the channel: nothing to track, skip early
+    if getattr(before.channel, "id", None) == getattr(after.channel, "id", None):
+        return
+
     uid = member.id
     gid = member.guild.id
     name = member.display_name or getattr(member, "global_name", None) or member.name
 
+    if after.channel:
+        channel_name_cache[after.channel.id] = after.channel.name
+
     # JOIN
     if not before.channel and after.channel:
-        active_users[(gid, uid)] = {"channel_id": after.channel.id}
-        _add_presence(gid, after.channel.id, uid)
-        print(f"[JOIN] {name} (uid={uid}) joined #{after.channel.name} | guild={member.guild.name} (gid={gid})")
-        _update_channel_gauges(member.guild, after.channel.id)
-        # refresh name info
+        _track_user(member.guild, uid, after.channel.id)
+        _console(f"[JOIN] {name} (uid={uid}) joined #{after.channel.name} | guild={member.guild.name} (gid={gid})")
+        _update_channel_gauges(gid, after.channel.id)
         _set_user_info(member)
-        _set_member_display(member)
         return
 
     # LEAVE
     if before.channel and not after.channel:
-        _remove_presence(gid, before.channel.id, uid)
-        active_users.pop((gid, uid), None)
-        print(f"[LEAVE] {name} (uid={uid}) left #{before.channel.name} | guild={member.guild.name} (gid={gid})")
-        _update_channel_gauges(member.guild, before.channel.id)
-        # still update name info (no harm)
-        _set_user_info(member)
-        _set_member_display(member)
+        _track_user(member.guild, uid, None)
+        _console(f"[LEAVE] {name} (uid={uid}) left #{before.channel.name} | guild={member.guild.name} (gid={gid})")
+        _update_channel_gauges(gid, before.channel.id)
         return
 
     # MOVE (optional: keep prints minimal; gauges/state still updated)
-    if before.channel and after.channel and before.channel.id != after.channel.id:
-        active_users.setdefault((gid, uid), {})["channel_id"] = after.channel.id
-        _remove_presence(gid, before.channel.id, uid)
-        _add_presence(gid, after.channel.id, uid)
-        _update_channel_gauges(member.guild, before.channel.id)
-        _update_channel_gauges(member.guild, after.channel.id)
-        # refresh name info
-        _set_user_info(member)
-        _set_member_display(member)
+    if before.channel and after.channel:
+        _track_user(member.guild, uid, after.channel.id)
+        _update_channel_gauges(gid, before.channel.id)
+        _update_channel_gauges(gid, after.channel.id)
 
-# ---- Name change events (keep "info" metrics current) ----
+# ---- Channel renames (refresh voice_channel_info) ----
 @bot.event
-async def on_user_update(before: discord.User, after: discord.User):
-    _set_user_info(after)
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if not isinstance(after, discord.VoiceChannel) or before.name == after.name:
+        return
+    channel_name_cache[after.id] = after.name
+    if after.id in _channel_info_names:
+        _set_channel_info(after.guild, after.id)
 
+# ---- Channel deleted: drop its caches & series ----
 @bot.event
-async def on_member_update(before: discord.Member, after: discord.Member):
-    _set_member_display(after)
-
-# ================== Accrual loop (monotonic) ==================
-@tasks.loop(seconds=TICK_SECONDS)
-async def accrue_loop():
-    """Increment counters every TICK_SECONDS based on current presence."""
-    global _last_tick
-    now_mono = time.monotonic()
-    dt = now_mono - _last_tick
-    if dt <= 0:
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    key = (channel.guild.id, channel.id)
+    # Members may still be counted in it; evict them first (no later event re-triggers this)
+    for gid, uid in [k for k, cid in user_channel.items() if k[0] == key[0] and cid == channel.id]:
+        _track_user(channel.guild, uid, None)
+    labels = _channel_labels_cache.pop(key, None)
+    channel_name_cache.pop(channel.id, None)
+    name = _channel_info_names.pop(channel.id, None)
+    if labels is None:
         return
-    _last_tick = now_mono
-
-    guild_map = {g.id: g for g in bot.guilds}
-
-    # 1) Per-user totals
-    for (gid, uid), _info in list(active_users.items()):
-        VOICE_USER_SECONDS.labels(guild_id=str(gid), user_id=str(uid)).inc(dt)
-
-    # 2) Per-channel union + live gauges
-    active_guilds: set[int] = set()
-    for (gid, cid), users in list(channel_presence.items()):
-        guild = guild_map.get(gid)
-        if guild is None:
-            continue
-        labels = _labels_channel(guild, cid)
-        if users:
-            VOICE_CHANNEL_ACTIVE_SECONDS.labels(**labels).inc(dt)
-            VOICE_CHANNEL_ACTIVE.labels(**labels).set(1)
-            VOICE_CHANNEL_ACTIVE_USERS.labels(**labels).set(len(users))
-            active_guilds.add(gid)
-        else:
-            VOICE_CHANNEL_ACTIVE.labels(**labels).set(0)
-            VOICE_CHANNEL_ACTIVE_USERS.labels(**labels).set(0)
+    if name is not None:
+        VOICE_CHANNEL_INFO.remove(labels["guild_id"], labels["channel_id"], name)
+    for metric in (VOICE_CHANNEL_ACTIVE, VOICE_CHANNEL_ACTIVE_USERS):
+        try:
+            metric.remove(labels["guild_id"], labels["channel_id"])
+        except KeyError:
+            pass
+    _channel_clocks.pop(key, None)
+
+# ---- Guild renames (label of voice_guild_active_seconds_total) ----
+@bot.event
+async def on_guild_update(before: discord.Guild, after: discord.Guild):
+    if after.id in guild_name_cache:
+        _set_guild_name(after.id, after.name)
 
-    # 3) Per-guild union time
-    for g in bot.guilds:
-        if g.id in active_guilds:
-            VOICE_GUILD_ACTIVE_SECONDS.labels(**_labels_guild(g)).inc(dt)
+# ---- Guild removed: stop accruing time for it ----
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    for gid, uid in [k for k in user_channel if k[0] == guild.id]:
+        _track_user(guild, uid, None)
 
 # ================== Run ==================
-if not token:
-    raise SystemExit("Set DISCORD_TOKEN in your environment (e.g., in .env).")
-
-bot.run(token, log_handler=handler, log_level=logging.INFO)
+def main() -> None:
+    if not token:
+        raise SystemExit("Set DISCORD_TOKEN in your environment (e.g., in .env).")
+    bot.run(token, log_handler=handler, log_level=logging.INFO)
+
+# Only run as a script, so importing this module never starts a second bot
+if __name__ == "__main__":
+    main()